@@ -2,19 +2,37 @@ from pathlib import Path
 import argparse
 import os
 import itertools
-from concurrent.futures import ProcessPoolExecutor
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 import cv2
+import numpy as np
 from insightface.app import FaceAnalysis
-from insightface.utils import face_align
+from insightface.utils import ensure_available, face_align
 
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+MODEL_PACK = "buffalo_l"
+MODEL_ROOT = "~/.insightface"
 
 
 def iter_images(images_dir: Path):
-    for path in images_dir.rglob("*"):
-        if path.is_file() and path.suffix.lower() in IMAGE_EXTS:
-            yield path
+    stack = [images_dir]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                    yield Path(entry.path)
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def parse_args() -> argparse.Namespace:
@@ -45,109 +63,332 @@ def parse_args() -> argparse.Namespace:
         default=2000,
         help="Max input dimension for detection. Larger images are downscaled.",
     )
+    parser.add_argument(
+        "--device",
+        choices=("cpu", "cuda"),
+        default="cpu",
+        help="Execution device for ONNX Runtime. cuda falls back to CPU if unavailable.",
+    )
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="Use an int8 dynamically quantized detector (CPU only; built on first use).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=_positive_int,
+        default=16,
+        help=(
+            "Images taken from the decode queue per step. Detection still runs "
+            "one image at a time; this only sets how far decoding runs ahead."
+        ),
+    )
     parser.add_argument(
         "--chunksize",
         type=int,
         default=1,
-        help="Chunk size for multiprocessing map.",
+        help="Deprecated and ignored: workers now receive whole buckets of paths.",
     )
     return parser.parse_args()
 
 
 _APP = None
+_APP_DET_SIZE = None
+_APP_KEY = None
+_APP_LOCK = threading.Lock()
 _ALIGN_SIZE = None
+_IO_WORKERS = 4
+_PREFETCH = 16
+# Only libjpeg can scale while decoding; for other formats OpenCV decodes at
+# full size and resizes, which is no cheaper than doing it ourselves.
+_REDUCED_DECODE_EXTS = {".jpg", ".jpeg"}
+# Start-of-frame markers carry the image size; C4, C8 and CC share the range
+# but are DHT, JPG and DAC segments.
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+
+
+def _providers(device: str) -> list:
+    if device == "cuda":
+        return [
+            (
+                "CUDAExecutionProvider",
+                {"device_id": 0, "cudnn_conv_algo_search": "HEURISTIC"},
+            ),
+            "CPUExecutionProvider",
+        ]
+    return ["CPUExecutionProvider"]
+
+
+def _ensure_quantized_pack(name: str = MODEL_PACK) -> str:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    src_dir = Path(ensure_available("models", name, root=MODEL_ROOT))
+    quant_name = f"{name}_int8"
+    dst_dir = src_dir.with_name(quant_name)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    for src in src_dir.glob("det_*.onnx"):
+        dst = dst_dir / src.name
+        if dst.exists():
+            continue
+        print(f"Quantizing {src.name} to int8...")
+        tmp = dst.with_name(dst.name + ".part")
+        quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, dst)
+    return quant_name
+
 
+def get_app(det_size: int, device: str = "cpu", pack: str = MODEL_PACK) -> FaceAnalysis:
+    global _APP, _APP_DET_SIZE, _APP_KEY
+    with _APP_LOCK:
+        if _APP is None or _APP_KEY != (device, pack):
+            _APP = FaceAnalysis(
+                name=pack,
+                root=MODEL_ROOT,
+                allowed_modules=["detection"],
+                providers=_providers(device),
+            )
+            _APP_KEY = (device, pack)
+            _APP_DET_SIZE = None
+        if _APP_DET_SIZE != det_size:
+            ctx_id = 0 if device == "cuda" else -1
+            _APP.prepare(ctx_id=ctx_id, det_size=(det_size, det_size))
+            _APP_DET_SIZE = det_size
+        return _APP
 
-def _init_worker(det_size: int, align_size: int) -> None:
-    global _APP, _ALIGN_SIZE
+
+def _init_worker(
+    det_size: int, align_size: int, device: str = "cpu", pack: str = MODEL_PACK
+) -> None:
+    global _ALIGN_SIZE
     _ALIGN_SIZE = align_size
-    _APP = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-    _APP.prepare(ctx_id=-1, det_size=(det_size, det_size))
+    get_app(det_size, device, pack)
 
 
-def _process_image(
-    image_path: Path,
-    images_dir: Path,
-    detected_dir: Path,
-    max_input: int,
-) -> tuple[int, int]:
-    img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+def _detect(img: np.ndarray) -> np.ndarray | None:
+    return _APP.det_model.detect(img, max_num=0)[1]
+
+
+def _sof_max_dim(handle) -> int | None:
+    if handle.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        marker = handle.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:
+            fill = handle.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:
+            continue
+        if code in (0xD9, 0xDA):
+            return None
+        length = handle.read(2)
+        if len(length) < 2 or int.from_bytes(length, "big") < 2:
+            return None
+        if code in _JPEG_SOF_MARKERS:
+            frame = handle.read(5)
+            if len(frame) < 5:
+                return None
+            return max(int.from_bytes(frame[1:3], "big"), int.from_bytes(frame[3:5], "big"))
+        handle.seek(int.from_bytes(length, "big") - 2, os.SEEK_CUR)
+
+
+def _jpeg_max_dim(image_path: Path) -> int | None:
+    # Files that cannot be read fall through to cv2.imread, which reports them
+    # as unreadable instead of aborting the run.
+    try:
+        with open(image_path, "rb") as handle:
+            return _sof_max_dim(handle)
+    except OSError:
+        return None
+
+
+def _load_image(image_path: Path, max_input: int) -> np.ndarray | None:
+    flags = cv2.IMREAD_COLOR
+    # A half-scale decode is only taken when the header shows it still clears
+    # --max-input, so no image is ever decoded twice.
+    if image_path.suffix.lower() in _REDUCED_DECODE_EXTS:
+        max_dim = _jpeg_max_dim(image_path)
+        if max_dim is not None and max_dim >= 2 * max_input:
+            flags = cv2.IMREAD_REDUCED_COLOR_2
+    img = cv2.imread(str(image_path), flags)
     if img is None:
         print(f"Skipping unreadable image: {image_path}")
-        return (1, 0)
+        return None
 
     height, width = img.shape[:2]
     max_dim = max(height, width)
-    if max_dim > max_input:
-        scale = max_input / max_dim
+    scale = max_input / max_dim
+    # Within 10% of max_input the detector's letterbox absorbs the difference;
+    # INTER_AREA only pays off over INTER_LINEAR below a 2x reduction.
+    if scale < 0.9:
+        interp = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
         new_w = max(1, int(width * scale))
         new_h = max(1, int(height * scale))
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        img = cv2.resize(img, (new_w, new_h), interpolation=interp)
+    return img
+
 
-    faces = _APP.get(img)
-    if not faces:
-        return (1, 0)
+def _save_faces(
+    img: np.ndarray,
+    kpss: np.ndarray | None,
+    image_path: Path,
+    images_dir: Path,
+    detected_dir: Path,
+) -> int:
+    if kpss is None or len(kpss) == 0:
+        return 0
 
     rel_stem = image_path.relative_to(images_dir).with_suffix("")
     safe_stem = "__".join(rel_stem.parts)
     saved = 0
-    for idx, face in enumerate(faces, start=1):
-        if face.kps is None:
-            continue
-        aligned = face_align.norm_crop(img, face.kps, image_size=_ALIGN_SIZE)
+    for idx, kps in enumerate(kpss, start=1):
+        aligned = face_align.norm_crop(img, kps, image_size=_ALIGN_SIZE)
         output_name = f"{safe_stem}_face{idx}.jpg"
         output_path = detected_dir / output_name
-        cv2.imwrite(str(output_path), aligned)
+        ok, buf = cv2.imencode(".jpg", aligned, _JPEG_PARAMS)
+        if not ok:
+            continue
+        output_path.write_bytes(buf.tobytes())
         saved += 1
-    return (1, saved)
+    return saved
+
+
+def _process_paths(
+    image_paths,
+    images_dir: Path,
+    detected_dir: Path,
+    max_input: int,
+    batch_size: int,
+) -> tuple[int, int]:
+    processed = 0
+    saved = 0
+    decoded: deque[tuple[Path, Future]] = deque()
+    written: deque[Future] = deque()
+    paths = iter(image_paths)
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=_IO_WORKERS) as readers, ThreadPoolExecutor(
+        max_workers=_IO_WORKERS
+    ) as writers:
+        while True:
+            while not exhausted and len(decoded) < batch_size + _PREFETCH:
+                image_path = next(paths, None)
+                if image_path is None:
+                    exhausted = True
+                    break
+                decoded.append((image_path, readers.submit(_load_image, image_path, max_input)))
+                processed += 1
+            if not decoded:
+                break
+
+            batch = []
+            while decoded and len(batch) < batch_size:
+                image_path, future = decoded.popleft()
+                img = future.result()
+                if img is not None:
+                    batch.append((image_path, img))
+            for image_path, img in batch:
+                kpss = _detect(img)
+                written.append(
+                    writers.submit(_save_faces, img, kpss, image_path, images_dir, detected_dir)
+                )
+            while len(written) > _PREFETCH:
+                saved += written.popleft().result()
+        saved += sum(future.result() for future in written)
+    return (processed, saved)
+
+
+def _process_bucket(
+    image_paths: list[Path],
+    images_dir: Path,
+    detected_dir: Path,
+    max_input: int,
+    batch_size: int,
+) -> tuple[int, int]:
+    return _process_paths(image_paths, images_dir, detected_dir, max_input, batch_size)
+
+
+def _run_serial(
+    images_dir: Path,
+    detected_dir: Path,
+    det_size: int,
+    align_size: int,
+    max_input: int,
+    batch_size: int,
+    device: str,
+    pack: str,
+) -> tuple[int, int]:
+    _init_worker(det_size, align_size, device, pack)
+    return _process_paths(
+        iter_images(images_dir), images_dir, detected_dir, max_input, batch_size
+    )
 
 
 def main() -> None:
     args = parse_args()
+    if args.quantized and args.device == "cuda":
+        # ONNX Runtime has no CUDA kernels for the int8 ops (ConvInteger etc.),
+        # so they would run on CPU with a device copy around each one.
+        raise SystemExit("--quantized is CPU only; drop --device cuda or --quantized.")
     root = Path(__file__).resolve().parents[1]
     images_dir = root / "segregated" / "images"
     detected_dir = root / "detected"
     if not images_dir.exists():
         raise SystemExit(f"segregated/images folder not found: {images_dir}")
 
-    images = iter_images(images_dir)
-
     detected_dir.mkdir(parents=True, exist_ok=True)
+    pack = _ensure_quantized_pack() if args.quantized else MODEL_PACK
 
     total_faces = 0
     processed = 0
     if args.workers <= 1:
-        _init_worker(args.det_size, args.size)
-        for image_path in images:
-            p, f = _process_image(image_path, images_dir, detected_dir, args.max_input)
-            processed += p
-            total_faces += f
+        processed, total_faces = _run_serial(
+            images_dir,
+            detected_dir,
+            args.det_size,
+            args.size,
+            args.max_input,
+            args.batch_size,
+            args.device,
+            pack,
+        )
     else:
         try:
             with ProcessPoolExecutor(
                 max_workers=args.workers,
                 initializer=_init_worker,
-                initargs=(args.det_size, args.size),
+                initargs=(args.det_size, args.size, args.device, pack),
             ) as executor:
+                images = list(iter_images(images_dir))
+                n_buckets = args.workers * 4
+                buckets = [images[i::n_buckets] for i in range(n_buckets)]
                 results = executor.map(
-                    _process_image,
-                    images,
+                    _process_bucket,
+                    [bucket for bucket in buckets if bucket],
                     itertools.repeat(images_dir),
                     itertools.repeat(detected_dir),
                     itertools.repeat(args.max_input),
-                    chunksize=args.chunksize,
+                    itertools.repeat(args.batch_size),
                 )
                 for p, f in results:
                     processed += p
                     total_faces += f
         except Exception as exc:
             print(f"Multiprocessing failed ({exc}); retrying with --workers 1")
-            _init_worker(args.det_size, args.size)
-            images = iter_images(images_dir)
-            for image_path in images:
-                p, f = _process_image(image_path, images_dir, detected_dir, args.max_input)
-                processed += p
-                total_faces += f
+            processed, total_faces = _run_serial(
+                images_dir,
+                detected_dir,
+                args.det_size,
+                args.size,
+                args.max_input,
+                args.batch_size,
+                args.device,
+                pack,
+            )
 
     if processed == 0:
         raise SystemExit(f"No images found in {images_dir}")
@@ -1,27 +1,48 @@
 from __future__ import annotations
 
 import argparse
+import os
 import re
 import shutil
+from hashlib import blake2b
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import tkinter as tk
 from tkinter import ttk
 
+import cv2
 import numpy as np
 from PIL import Image, ImageTk
-from deepface import DeepFace
 
 
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
 
+EMBED_BATCH_SIZE = 64
+# Bounds how many preprocessed faces are held in memory per predict() call.
+PREDICT_CHUNK = 1024
+POLL_INTERVAL_MS = 50
+# Unit-norm rows keep cosine scores in [-1, 1], where fp16 rounding error is
+# around 1e-3; thresholds tuned against float32 scores may need that slack.
+GALLERY_DTYPE = np.float16
+# Gallery rows are upcast for scoring in blocks this size, so the float32
+# temporary stays cache-resident instead of doubling the bytes read per image.
+SCORE_BLOCK_BYTES = 256 * 1024
+
 
 def iter_images(images_dir: Path) -> list[Path]:
-    return [
-        path
-        for path in sorted(images_dir.rglob("*"))
-        if path.is_file() and path.suffix.lower() in IMAGE_EXTS
-    ]
+    images: list[Path] = []
+    stack = [images_dir]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                    images.append(Path(entry.path))
+    images.sort()
+    return images
 
 
 def parse_args() -> argparse.Namespace:
@@ -48,8 +69,8 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--max-ref-per-label",
         type=int,
-        default=4,
-        help="Max reference images per existing label to build suggestions.",
+        default=0,
+        help="Max reference images per existing label to build suggestions (0 = all).",
     )
     parser.add_argument(
         "--auto-accept-suggestions",
@@ -60,11 +81,13 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+_LABEL_INVALID = re.compile(r"[^a-zA-Z0-9 _-]+")
+_LABEL_SEPARATORS = re.compile(r"[ _]+")
+
+
 def _safe_label(label: str) -> str:
-    cleaned = label.strip()
-    cleaned = re.sub(r"[^a-zA-Z0-9 _-]+", "", cleaned)
-    cleaned = re.sub(r"\s+", "_", cleaned)
-    cleaned = re.sub(r"_+", "_", cleaned)
+    cleaned = _LABEL_INVALID.sub("", label)
+    cleaned = _LABEL_SEPARATORS.sub("_", cleaned)
     return cleaned.strip("_")
 
 
@@ -82,6 +105,84 @@ def _unique_destination(dest_dir: Path, name: str) -> Path:
         i += 1
 
 
+def _cache_path(identified_dir: Path, model_name: str) -> Path:
+    return identified_dir / f".embeddings_{model_name}.npz"
+
+
+def _content_key(image_path: Path, head_size: int = 64 * 1024) -> str | None:
+    try:
+        with image_path.open("rb") as handle:
+            head = handle.read(head_size)
+    except OSError:
+        return None
+    return blake2b(head, digest_size=16).hexdigest()
+
+
+def _load_cache(identified_dir: Path, model_name: str) -> dict[str, np.ndarray]:
+    cache_path = _cache_path(identified_dir, model_name)
+    if not cache_path.exists():
+        return {}
+    try:
+        with np.load(cache_path) as data:
+            keys, vecs = data["keys"], data["vecs"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {str(key): _normalize(vec) for key, vec in zip(keys, vecs)}
+
+
+def _save_cache(
+    identified_dir: Path, model_name: str, cache: dict[str, np.ndarray]
+) -> None:
+    items = list(cache.items())
+    if not items:
+        return
+    np.savez_compressed(
+        _cache_path(identified_dir, model_name),
+        keys=np.array([key for key, _ in items]),
+        vecs=np.stack([vec for _, vec in items]),
+    )
+
+
+def _load_model(deepface, model_name: str):
+    try:
+        client = deepface.build_model(model_name)
+    except Exception:
+        return None
+    model = getattr(client, "model", client)
+    if not hasattr(model, "predict") or not hasattr(model, "input_shape"):
+        return None
+    return model
+
+
+def _prepare_face(image_path: Path, target_hw: tuple[int, int]) -> np.ndarray | None:
+    img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    target_h, target_w = target_hw
+    height, width = img.shape[:2]
+    factor = min(target_h / height, target_w / width)
+    new_w = max(1, int(width * factor))
+    new_h = max(1, int(height * factor))
+    img = cv2.resize(img, (new_w, new_h))
+    pad_h = target_h - new_h
+    pad_w = target_w - new_w
+    img = np.pad(
+        img,
+        ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)),
+    )
+    face = img.astype(np.float32)
+    face /= 255.0
+    return face
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        return vec.astype(np.float32)
+    return (vec / norm).astype(np.float32)
+
+
 class LabelerApp:
     def __init__(
         self,
@@ -93,6 +194,8 @@ class LabelerApp:
         threshold: float,
         max_ref_per_label: int,
         auto_accept_suggestions: bool,
+        deepface,
+        model=None,
     ) -> None:
         self.root = root
         self.images = images
@@ -103,10 +206,18 @@ class LabelerApp:
         self.max_ref_per_label = max_ref_per_label
         self.auto_accept_suggestions = auto_accept_suggestions
         self.index = 0
-        self.current_image: Image.Image | None = None
+        self.current_image: np.ndarray | None = None
         self.current_photo: ImageTk.PhotoImage | None = None
         self.current_embedding: np.ndarray | None = None
-        self.label_index: dict[str, list[np.ndarray]] = {}
+        self._embedding_resolved = False
+        self.gallery = np.zeros((0, 0), dtype=GALLERY_DTYPE)
+        self.gallery_labels: list[str] = []
+        self.embedding_cache = _load_cache(identified_dir, model_name)
+        self.cache_dirty = False
+        self._deepface = deepface
+        self._model = model
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending: dict[int, Future] = {}
         self.auto_accept_var = tk.BooleanVar(value=auto_accept_suggestions)
 
         self.root.title("Face Labeler")
@@ -182,26 +293,83 @@ class LabelerApp:
         self.root.update_idletasks()
         if not self.identified_dir.exists():
             return
+        labels: list[str] = []
+        paths: list[Path] = []
         for label_dir in sorted(self.identified_dir.iterdir()):
             if not label_dir.is_dir():
                 continue
-            label = label_dir.name
-            images = iter_images(label_dir)[: self.max_ref_per_label]
-            if not images:
-                continue
-            vectors: list[np.ndarray] = []
+            images = iter_images(label_dir)
+            if self.max_ref_per_label > 0:
+                images = images[: self.max_ref_per_label]
             for img_path in images:
-                embedding = self._get_embedding(img_path)
-                if embedding is None:
-                    continue
-                vectors.append(embedding)
-            if vectors:
-                self.label_index[label] = vectors
+                labels.append(label_dir.name)
+                paths.append(img_path)
+
+        vectors: list[np.ndarray] = []
+        for label, embedding in zip(labels, self._embed_paths(paths)):
+            if embedding is None:
+                continue
+            self.gallery_labels.append(label)
+            vectors.append(embedding)
+        if vectors:
+            self.gallery = np.stack(vectors).astype(GALLERY_DTYPE)
         self.set_status("Ready.")
 
+    def save_cache(self) -> None:
+        if self.cache_dirty:
+            _save_cache(self.identified_dir, self.model_name, self.embedding_cache)
+            self.cache_dirty = False
+
     def _get_embedding(self, image_path: Path) -> np.ndarray | None:
+        return self._embed_paths([image_path])[0]
+
+    def _embed_paths(self, paths: list[Path]) -> list[np.ndarray | None]:
+        keys = [_content_key(path) for path in paths]
+        embeddings = [
+            self.embedding_cache.get(key) if key is not None else None for key in keys
+        ]
+        missing = [pos for pos, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+        computed = self._compute_embeddings([paths[pos] for pos in missing])
+        for pos, embedding in zip(missing, computed):
+            if embedding is None:
+                continue
+            embedding = _normalize(embedding)
+            embeddings[pos] = embedding
+            if keys[pos] is not None:
+                self.embedding_cache[keys[pos]] = embedding
+                self.cache_dirty = True
+        return embeddings
+
+    def _compute_embeddings(self, paths: list[Path]) -> list[np.ndarray | None]:
+        if self._model is None:
+            return [self._represent(path) for path in paths]
+        target_hw = tuple(self._model.input_shape[1:3])
+        embeddings: list[np.ndarray | None] = [None] * len(paths)
+        for start in range(0, len(paths), PREDICT_CHUNK):
+            positions: list[int] = []
+            faces: list[np.ndarray] = []
+            for pos in range(start, min(start + PREDICT_CHUNK, len(paths))):
+                face = _prepare_face(paths[pos], target_hw)
+                if face is not None:
+                    positions.append(pos)
+                    faces.append(face)
+            if not faces:
+                continue
+            try:
+                vectors = self._model.predict(
+                    np.stack(faces), batch_size=EMBED_BATCH_SIZE, verbose=0
+                )
+            except Exception:
+                continue
+            for pos, vec in zip(positions, vectors):
+                embeddings[pos] = np.asarray(vec, dtype=np.float32)
+        return embeddings
+
+    def _represent(self, image_path: Path) -> np.ndarray | None:
         try:
-            reps = DeepFace.represent(
+            reps = self._deepface.represent(
                 img_path=str(image_path),
                 model_name=self.model_name,
                 enforce_detection=False,
@@ -215,25 +383,24 @@ class LabelerApp:
             return None
         return np.asarray(embedding, dtype=np.float32)
 
+    def _add_to_gallery(self, label: str, embedding: np.ndarray) -> None:
+        vec = embedding.astype(GALLERY_DTYPE)[np.newaxis, :]
+        self.gallery = vec if not self.gallery_labels else np.vstack([self.gallery, vec])
+        self.gallery_labels.append(label)
+
     def _suggest_label(self, embedding: np.ndarray) -> tuple[str | None, float | None]:
-        best_label: str | None = None
-        best_score: float | None = None
-        for label, vectors in self.label_index.items():
-            for vec in vectors:
-                score = self._cosine_similarity(embedding, vec)
-                if best_score is None or score > best_score:
-                    best_score = score
-                    best_label = label
-        if best_score is None or best_score < self.threshold:
+        if not self.gallery_labels:
             return None, None
-        return best_label, best_score
-
-    @staticmethod
-    def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-        denom = (np.linalg.norm(a) * np.linalg.norm(b))
-        if denom == 0:
-            return -1.0
-        return float(np.dot(a, b) / denom)
+        rows = max(1, SCORE_BLOCK_BYTES // (self.gallery.shape[1] * 4))
+        scores = np.empty(len(self.gallery_labels), dtype=np.float32)
+        for start in range(0, len(scores), rows):
+            block = self.gallery[start : start + rows].astype(np.float32)
+            np.matmul(block, embedding, out=scores[start : start + rows])
+        best = int(scores.argmax())
+        best_score = float(scores[best])
+        if best_score < self.threshold:
+            return None, None
+        return self.gallery_labels[best], best_score
 
     def load_current(self) -> None:
         if self.index >= len(self.images):
@@ -245,42 +412,65 @@ class LabelerApp:
             return
 
         image_path = self.images[self.index]
-        try:
-            self.current_image = Image.open(image_path).convert("RGB")
-        except OSError:
+        img_bgr = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+        if img_bgr is None:
             self.set_status(f"Failed to open {image_path.name}")
             self.index += 1
             self.load_current()
             return
-
+        self.current_image = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
         self._display_image(self.current_image)
         self.label_var.set("")
         self._set_suggestion(None, None)
+        self.current_embedding = None
+        self._embedding_resolved = False
         self.set_status(f"Scanning {image_path.name} with {self.model_name}...")
-        self.root.update_idletasks()
+        # Deferred to idle so a run of auto-accepted images unwinds the stack
+        # and repaints between saves instead of recursing through them.
+        self.root.after_idle(self._poll_embedding, self.index)
+
+    def _embedding_future(self, index: int) -> Future:
+        future = self._pending.get(index)
+        if future is None:
+            future = self._pool.submit(self._get_embedding, self.images[index])
+            self._pending[index] = future
+        return future
+
+    def _poll_embedding(self, index: int) -> None:
+        if index != self.index:
+            return
+        future = self._embedding_future(index)
+        if not future.done():
+            self.root.after(POLL_INTERVAL_MS, self._poll_embedding, index)
+            return
+        del self._pending[index]
+        self._embedding_resolved = True
+        if index + 1 < len(self.images):
+            self._embedding_future(index + 1)
 
+        image_path = self.images[index]
         try:
-            self.current_embedding = self._get_embedding(image_path)
-            if self.current_embedding is not None and self.label_index:
+            self.current_embedding = future.result()
+            if self.current_embedding is not None and self.gallery_labels:
                 label, score = self._suggest_label(self.current_embedding)
                 self._set_suggestion(label, score)
                 if label and self.auto_accept_var.get():
+                    # Saved in this callback so the gallery row exists before
+                    # the next image is scored and no keypress can slip in.
                     self.label_var.set(label)
-                    self.set_status(f"Auto-saved suggestion: {label}")
-                    self.root.update_idletasks()
-                    self.root.after(1, self.save_current)
+                    self.save_current()
                     return
             self.set_status(f"Ready to label: {image_path.name}")
         except Exception as exc:  # pragma: no cover - depends on DeepFace runtime
             self.set_status(f"DeepFace failed: {exc}")
 
-    def _display_image(self, image: Image.Image) -> None:
-        width, height = image.size
+    def _display_image(self, image: np.ndarray) -> None:
+        height, width = image.shape[:2]
         scale = min(self.max_size / width, self.max_size / height, 1.0)
         if scale < 1.0:
-            new_size = (int(width * scale), int(height * scale))
-            image = image.resize(new_size, Image.BICUBIC)
-        self.current_photo = ImageTk.PhotoImage(image)
+            new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+        self.current_photo = ImageTk.PhotoImage(Image.fromarray(image))
         self.image_label.configure(image=self.current_photo)
 
     def use_suggestion(self) -> None:
@@ -307,17 +497,37 @@ class LabelerApp:
         src_path = self.images[self.index]
         dest_path = _unique_destination(dest_dir, src_path.name)
         shutil.copy2(src_path, dest_path)
-        if self.current_embedding is None:
-            self.current_embedding = self._get_embedding(src_path)
         if self.current_embedding is not None:
-            self.label_index.setdefault(label, []).append(self.current_embedding)
+            self._add_to_gallery(label, self.current_embedding)
+        elif not self._embedding_resolved:
+            # Saved before the model finished, or before the first poll even
+            # queued it; add the row once it is ready rather than blocking.
+            self._embedding_future(self.index)
+            self._add_when_ready(label, self._pending.pop(self.index))
         self.set_status(f"Saved to {dest_path.parent.name}/")
         self.next_image()
 
+    def _add_when_ready(self, label: str, future: Future) -> None:
+        if not future.done():
+            self.root.after(POLL_INTERVAL_MS, self._add_when_ready, label, future)
+            return
+        try:
+            embedding = future.result()
+        except Exception:  # pragma: no cover - depends on DeepFace runtime
+            return
+        if embedding is not None:
+            self._add_to_gallery(label, embedding)
+
     def next_image(self) -> None:
         self.index += 1
+        for index in [i for i in self._pending if i < self.index]:
+            self._pending.pop(index).cancel()
         self.load_current()
 
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.save_cache()
+
 
 def main() -> None:
     args = parse_args()
@@ -334,8 +544,10 @@ def main() -> None:
 
     identified_dir.mkdir(parents=True, exist_ok=True)
 
+    from deepface import DeepFace
+
     root = tk.Tk()
-    LabelerApp(
+    app = LabelerApp(
         root,
         images,
         identified_dir,
@@ -344,8 +556,11 @@ def main() -> None:
         args.threshold,
         args.max_ref_per_label,
         args.auto_accept_suggestions,
+        DeepFace,
+        _load_model(DeepFace, args.model),
     )
     root.mainloop()
+    app.close()
 
 
 if __name__ == "__main__":
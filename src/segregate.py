@@ -1,11 +1,36 @@
 from __future__ import annotations
 
+import argparse
+import errno
+import mmap
 import os
+import re
 import sys
 import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from hashlib import blake2b
 
+try:
+    import blake3
+except ImportError:  # pragma: no cover - optional dependency
+    blake3 = None
+
+try:
+    from fastcdc import fastcdc
+except ImportError:  # pragma: no cover - optional dependency
+    fastcdc = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
 
 IMAGE_EXTS = {
     ".jpg",
@@ -39,100 +64,602 @@ VIDEO_EXTS = {
 }
 
 
-def _copy_file(src_path: Path, dest_dir: Path) -> None:
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    target = dest_dir / src_path.name
-    if target.exists():
-        stem = src_path.stem
-        suffix = src_path.suffix
-        i = 1
+
+def _ext_alternation(exts: set[str]) -> str:
+    return "|".join(re.escape(ext[1:]) for ext in sorted(exts))
+
+
+# Group 1 is an image, group 2 a video. The leading "\.*[^.]" mirrors
+# os.path.splitext, which gives dotfiles such as ".jpg" no extension.
+_MEDIA_EXT = re.compile(
+    rf"\.*[^.].*\.(?:({_ext_alternation(IMAGE_EXTS)})|({_ext_alternation(VIDEO_EXTS)}))",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Strips the "_N" tails _reserve_target adds, so "IMG.jpg", "IMG_1.jpg" and
+# "IMG_1_2.jpg" land in one name family.
+_NUMBERED_STEM = re.compile(r"(?:_\d+)+$")
+
+HEAD_TAIL_WINDOW = 64 * 1024
+HASH_WORKERS = os.cpu_count() or 1
+COPY_WORKERS = 4
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+HASH_BUFFER_SIZE = 1024 * 1024
+PARALLEL_HASH_THRESHOLD = 64 * 1024 * 1024
+# Mapping a whole file needs that much address space, which 32-bit builds lack.
+MMAP_HASH_LIMIT = sys.maxsize if sys.maxsize > 2**32 else 2 * 1024**3
+COPY_QUEUE_DEPTH = 256
+SCAN_BATCH_SIZE = 1024
+PROGRESS_INTERVAL = 0.1
+CDC_MIN_SIZE = 2 * 1024 * 1024
+CDC_AVG_SIZE = 8 * 1024 * 1024
+CDC_MAX_SIZE = 16 * 1024 * 1024
+CDC_SIMILARITY = 0.8
+# From linux/fs.h: _IOW(0x94, 9, int).
+FICLONE = 0x40049409
+_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTSOCK,
+    errno.EBADF,
+}
+
+
+def _keep_case(name: str) -> str:
+    return name
+
+
+def _case_insensitive(directory: str) -> bool:
+    fd, probe = tempfile.mkstemp(prefix=".Case-", dir=directory)
+    os.close(fd)
+    try:
+        return os.path.exists(os.path.join(directory, os.path.basename(probe).swapcase()))
+    finally:
+        os.unlink(probe)
+
+
+def _reserve_target(
+    name: str,
+    dest_dir: str,
+    reserved: set[str],
+    counters: dict[tuple[str, str, str], int],
+    fold: Callable[[str], str] = _keep_case,
+) -> str:
+    # `reserved` holds folded paths, so on a case-insensitive destination
+    # "IMG.JPG" and "img.jpg" cannot both be handed out before either exists.
+    target = os.path.join(dest_dir, name)
+    if fold(target) in reserved or os.path.exists(target):
+        stem, suffix = os.path.splitext(name)
+        key = (dest_dir, fold(stem), fold(suffix))
+        i = counters.get(key, 1)
         while True:
-            candidate = dest_dir / f"{stem}_{i}{suffix}"
-            if not candidate.exists():
+            candidate = os.path.join(dest_dir, f"{stem}_{i}{suffix}")
+            if fold(candidate) not in reserved and not os.path.exists(candidate):
                 target = candidate
                 break
             i += 1
+        counters[key] = i + 1
+    reserved.add(fold(target))
+    return target
+
+
+def _fadvise(fd: int, *advice: str) -> None:
+    if hasattr(os, "posix_fadvise"):
+        for name in advice:
+            os.posix_fadvise(fd, 0, 0, getattr(os, f"POSIX_FADV_{name}"))
+
+
+def _prefetch(path: str) -> None:
+    with open(path, "rb") as handle:
+        _fadvise(handle.fileno(), "WILLNEED")
+
+
+def _drop_cached(path: str) -> None:
+    with open(path, "rb") as handle:
+        _fadvise(handle.fileno(), "DONTNEED")
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, size: int) -> bool:
+    copiers = []
+    if hasattr(os, "copy_file_range"):
+        copiers.append(lambda offset: os.copy_file_range(src_fd, dst_fd, size - offset))
+    if hasattr(os, "sendfile"):
+        copiers.append(lambda offset: os.sendfile(dst_fd, src_fd, offset, size - offset))
+    for copier in copiers:
+        copied = 0
+        try:
+            while copied < size:
+                sent = copier(copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as exc:
+            if copied or exc.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+            continue
+        if copied == size:
+            return True
+        # Some FUSE, network and proc filesystems report 0 up front instead of
+        # failing; nothing was written, so the next copier can take over.
+        if copied:
+            raise OSError(errno.EIO, f"short copy: {copied} of {size} bytes")
+    return False
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def _hardlink(src_path: str, target: str) -> bool:
+    try:
+        os.link(src_path, target)
+    except OSError:
+        return False
+    return True
+
+
+def _fast_copy(src_path: str, target: str, clone: bool = False) -> None:
+    with open(src_path, "rb") as src, open(target, "xb") as dst:
+        _fadvise(src.fileno(), "SEQUENTIAL")
+        if not (clone and _reflink(src.fileno(), dst.fileno())):
+            size = os.fstat(src.fileno()).st_size
+            if not _kernel_copy(src.fileno(), dst.fileno(), size):
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+    shutil.copystat(src_path, target)
+
+
+def _copy_file(
+    src_path: str, target: str, same_fs: bool = False, hardlink: bool = False
+) -> None:
     try:
-        shutil.copy2(str(src_path), str(target))
+        if same_fs and hardlink and _hardlink(src_path, target):
+            return
+        _fast_copy(src_path, target, clone=same_fs)
     except PermissionError:
         return
 
 
-def _file_digest(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
-    hasher = blake2b()
-    with path.open("rb") as handle:
-        for chunk in iter(lambda: handle.read(chunk_size), b""):
+_hash_buffers = threading.local()
+
+
+def _hash_buffer() -> memoryview:
+    view = getattr(_hash_buffers, "view", None)
+    if view is None:
+        view = _hash_buffers.view = memoryview(bytearray(HASH_BUFFER_SIZE))
+    return view
+
+
+def _blake3_hasher(size: int) -> blake3.blake3:
+    # Below the threshold, spinning up worker threads costs more than it saves.
+    if size > PARALLEL_HASH_THRESHOLD:
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return blake3.blake3()
+
+
+def _file_digest(path: str, size: int) -> str:
+    if blake3 is not None:
+        # update_mmap opens and maps the file itself, so there is no descriptor
+        # of ours to advise; callers prefetch with WILLNEED beforehand.
+        hasher = _blake3_hasher(size)
+        hasher.update_mmap(path)
+        return hasher.hexdigest()
+    with open(path, "rb", buffering=0) as handle:
+        hasher = blake2b()
+        if 0 < size <= MMAP_HASH_LIMIT:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for advice in ("MADV_SEQUENTIAL", "MADV_WILLNEED"):
+                    if hasattr(mmap, advice):
+                        mapped.madvise(getattr(mmap, advice))
+                hasher.update(mapped)
+        else:
+            _fadvise(handle.fileno(), "SEQUENTIAL", "WILLNEED")
+            view = _hash_buffer()
+            while n := handle.readinto(view):
+                hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def _copy_and_hash(src_path: str, temp: str) -> str:
+    view = _hash_buffer()
+    with open(src_path, "rb", buffering=0) as src, open(temp, "wb", buffering=0) as dst:
+        if blake3 is not None:
+            hasher = _blake3_hasher(os.fstat(src.fileno()).st_size)
+        else:
+            hasher = blake2b()
+        _fadvise(src.fileno(), "SEQUENTIAL")
+        while n := src.readinto(view):
+            chunk = view[:n]
             hasher.update(chunk)
+            while chunk:
+                chunk = chunk[dst.write(chunk):]
+    shutil.copystat(src_path, temp)
+    return hasher.hexdigest()
+
+
+def _move_staged(temp: str, target: str) -> None:
+    # os.replace would overwrite an existing target; a link fails instead.
+    try:
+        os.link(temp, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hardlinks on this filesystem (FAT and friends).
+        _fast_copy(temp, target)
+    os.unlink(temp)
+
+
+def _file_head_tail_digest(path: str, size: int, window: int = HEAD_TAIL_WINDOW) -> str:
+    hasher = blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        hasher.update(handle.read(window))
+        if size > window:
+            handle.seek(max(window, size - window))
+            hasher.update(handle.read(window))
     return hasher.hexdigest()
 
 
-def _iter_files(root: Path) -> list[Path]:
-    files: list[Path] = []
+def _iter_files(
+    root: str, batch_size: int = SCAN_BATCH_SIZE
+) -> Iterator[list[tuple[str, os.stat_result]]]:
+    batch: list[tuple[str, os.stat_result]] = []
     stack = [root]
     while stack:
         current = stack.pop()
         with os.scandir(current) as entries:
             for entry in entries:
                 if entry.is_dir(follow_symlinks=False):
-                    stack.append(Path(entry.path))
+                    stack.append(entry.path)
                 elif entry.is_file(follow_symlinks=False):
-                    files.append(Path(entry.path))
-    return files
+                    batch.append((entry.path, entry.stat(follow_symlinks=False)))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+    if batch:
+        yield batch
+
+
+class _CopyQueue:
+    def __init__(self, segregated_dir: str, same_fs: bool, hardlink: bool) -> None:
+        images_dir = os.path.join(segregated_dir, "images")
+        videos_dir = os.path.join(segregated_dir, "videos")
+        self.others = os.path.join(segregated_dir, "others")
+        # Created once here; _copy_file and _move_staged assume they exist.
+        for dest_dir in (images_dir, videos_dir, self.others):
+            os.makedirs(dest_dir, exist_ok=True)
+        self.media_dirs = (self.others, images_dir, videos_dir)
+        self.reserved: set[str] = set()
+        self.name_counters: dict[tuple[str, str, str], int] = {}
+        self.fold = str.casefold if _case_insensitive(segregated_dir) else _keep_case
+        # Names are reserved on the main thread and, after a clash, by workers.
+        self.lock = threading.Lock()
+        self.same_fs = same_fs
+        self.hardlink = hardlink
+        self.pool = ThreadPoolExecutor(max_workers=COPY_WORKERS)
+        self.in_flight: deque[Future] = deque()
+        self.queued = 0
+        self.processed = 0
+        self.last_report = 0.0
+
+    def _route(self, src_path: str) -> tuple[str, str]:
+        name = os.path.basename(src_path)
+        match = _MEDIA_EXT.fullmatch(name)
+        return (self.others if match is None else self.media_dirs[match.lastindex]), name
+
+    def name_family(self, src_path: str) -> tuple[str, str, str]:
+        # Two files can only compete for a target name within one family.
+        dest_dir, name = self._route(src_path)
+        stem, suffix = os.path.splitext(name)
+        return dest_dir, self.fold(_NUMBERED_STEM.sub("", stem)), self.fold(suffix)
+
+    def _reserve(self, dest_dir: str, name: str) -> str:
+        with self.lock:
+            return _reserve_target(
+                name, dest_dir, self.reserved, self.name_counters, self.fold
+            )
+
+    def _place(
+        self, src_path: str, dest_dir: str, name: str, staged: str | None, target: str
+    ) -> None:
+        while True:
+            try:
+                if staged is not None:
+                    _move_staged(staged, target)
+                else:
+                    _copy_file(src_path, target, self.same_fs, self.hardlink)
+                return
+            except FileExistsError:
+                # Targets are created exclusively; something outside this run
+                # took the name after it was reserved, so move on to the next.
+                target = self._reserve(dest_dir, name)
+
+    def submit(self, src_path: str, staged: str | None = None) -> None:
+        dest_dir, name = self._route(src_path)
+        target = self._reserve(dest_dir, name)
+        self.in_flight.append(
+            self.pool.submit(self._place, src_path, dest_dir, name, staged, target)
+        )
+        self.queued += 1
+        self._drain(COPY_QUEUE_DEPTH)
+
+    def _drain(self, limit: int) -> None:
+        while len(self.in_flight) > limit:
+            self.in_flight.popleft().result()
+            self.processed += 1
+            now = time.monotonic()
+            if now - self.last_report >= PROGRESS_INTERVAL or self.processed == self.queued:
+                self.last_report = now
+                self._report()
 
+    def _report(self) -> None:
+        percent = (self.processed / self.queued) * 100 if self.queued else 100
+        sys.stdout.write(f"\rProcessed {self.processed}/{self.queued} files ({percent:5.1f}%)")
+        sys.stdout.flush()
 
-def segregate_resources(resources_dir: Path, segregated_dir: Path) -> None:
-    images_dir = segregated_dir / "images"
-    videos_dir = segregated_dir / "videos"
-    others = segregated_dir / "others"
-    seen_sizes: dict[int, Path | set[str]] = {}
+    def close(self) -> None:
+        self._drain(0)
+        self.pool.shutdown()
+        if self.processed:
+            sys.stdout.write("\n")
 
-    files = _iter_files(resources_dir)
-    total = len(files)
-    processed = 0
-    progress_every = max(1, total // 200)
 
-    for src_path in files:
-        if src_path.name == ".gitkeep":
+def _dedup_collisions(
+    size_groups: dict[int, list[tuple[int, str]]],
+    staging_dir: str | None = None,
+) -> tuple[list[tuple[int, str]], dict[tuple[int, str], str]]:
+    # Read in (dir, name) order, which tends to follow the on-disk layout.
+    # Keepers are chosen by discovery index below, not by read order.
+    candidates: list[tuple[int, str, int]] = sorted(
+        (
+            (index, path, size)
+            for size, group in size_groups.items()
+            if len(group) > 1
+            for index, path in group
+        ),
+        key=lambda item: os.path.split(item[1]),
+    )
+    unique: list[tuple[int, str]] = []
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        head_tail_groups: dict[tuple[int, str], list[tuple[int, str]]] = {}
+        head_tails = pool.map(lambda item: _file_head_tail_digest(item[1], item[2]), candidates)
+        for (index, path, size), head_tail in zip(candidates, head_tails):
+            head_tail_groups.setdefault((size, head_tail), []).append((index, path))
+
+        to_digest: list[tuple[int, str]] = []
+        digest_sizes: dict[tuple[int, str], int] = {}
+        group_paths: dict[tuple[int, str], list[str]] = {}
+        for (size, _), group in head_tail_groups.items():
+            # Head and tail windows cover small files entirely, so the match is exact.
+            if len(group) == 1 or size <= 2 * HEAD_TAIL_WINDOW:
+                unique.append(min(group))
+            else:
+                group_paths[group[0]] = [path for _, path in group]
+                digest_sizes.update((item, size) for item in group)
+                to_digest.extend(group)
+
+        # With a staging dir, files that would need copying afterwards are
+        # copied while being hashed so they are only read once. Keepers were
+        # already copied during the walk and are just hashed.
+        temps: dict[tuple[int, str], str] = {}
+        if staging_dir is not None:
+            keepers = {group[0] for group in size_groups.values()}
+            temps = {
+                item: os.path.join(staging_dir, str(item[0]))
+                for item in to_digest
+                if item not in keepers
+            }
+
+        def digest(item: tuple[int, str]) -> str:
+            # Members of a group are hashed back to back; the first one asks
+            # the kernel to start reading the whole group in.
+            for path in group_paths.get(item, ()):
+                _prefetch(path)
+            temp = temps.get(item)
+            if temp is None:
+                return _file_digest(item[1], digest_sizes[item])
+            return _copy_and_hash(item[1], temp)
+
+        digests = list(zip(to_digest, pool.map(digest, to_digest)))
+        earliest: dict[str, tuple[int, str]] = {}
+        for item, item_digest in digests:
+            if item_digest not in earliest or item < earliest[item_digest]:
+                earliest[item_digest] = item
+        kept = set(earliest.values())
+        staged: dict[tuple[int, str], str] = {}
+        for item, _ in digests:
+            temp = temps.get(item)
+            if item in kept:
+                unique.append(item)
+                if temp is not None:
+                    staged[item] = temp
+            elif temp is not None:
+                os.unlink(temp)
+            else:
+                # Duplicates are never copied, so their pages are dead weight.
+                _drop_cached(item[1])
+    unique.sort()
+    return unique, staged
+
+
+def _chunk_hashes(path: str) -> set[str]:
+    hasher = blake3.blake3 if blake3 is not None else blake2b
+    return {
+        chunk.hash
+        for chunk in fastcdc(path, CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE, hf=hasher)
+    }
+
+
+def _drop_near_duplicates(
+    items: list[tuple[int, str, int]], similarity: float
+) -> list[tuple[int, str, int]]:
+    # Anything below the minimum chunk size is a single chunk, which only ever
+    # matches an exact duplicate, and those are already gone.
+    chunked = [item for item in items if item[2] > CDC_MIN_SIZE]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        chunk_sets = dict(zip(chunked, pool.map(lambda item: _chunk_hashes(item[1]), chunked)))
+
+    kept: list[tuple[int, str, int]] = []
+    kept_sets: list[set[str]] = []
+    owners: dict[str, list[int]] = {}
+    for item in items:
+        chunks = chunk_sets.get(item)
+        if chunks is None:
+            kept.append(item)
             continue
-        size = src_path.stat().st_size
-        entry = seen_sizes.get(size)
-        if entry is None:
-            seen_sizes[size] = src_path
-        elif isinstance(entry, Path):
-            existing_digest = _file_digest(entry)
-            digest = _file_digest(src_path)
-            if digest == existing_digest:
-                continue
-            digests = {existing_digest, digest}
-            seen_sizes[size] = digests
-        else:
-            digest = _file_digest(src_path)
-            if digest in entry:
+        shared: Counter[int] = Counter()
+        for chunk in chunks:
+            shared.update(owners.get(chunk, ()))
+        if any(
+            common / (len(chunks) + len(kept_sets[owner]) - common) >= similarity
+            for owner, common in shared.items()
+        ):
+            continue
+        for chunk in chunks:
+            owners.setdefault(chunk, []).append(len(kept_sets))
+        kept_sets.append(chunks)
+        kept.append(item)
+    return kept
+
+
+def segregate_resources(
+    resources_dir: Path,
+    segregated_dir: Path,
+    hardlink: bool = False,
+    dedup_mode: str = "exact",
+    similarity: float = CDC_SIMILARITY,
+) -> None:
+    segregated_dir.mkdir(parents=True, exist_ok=True)
+    same_fs = resources_dir.stat().st_dev == segregated_dir.stat().st_dev
+    copies = _CopyQueue(str(segregated_dir), same_fs, hardlink)
+    size_groups: dict[int, list[tuple[int, str]]] = {}
+    seen_inodes: set[tuple[int, int]] = set()
+    discovered = 0
+    # In exact mode the first file of each size is always the one kept, so it
+    # can be copied straight away; later same-size files wait for the dedup
+    # pass. Near-duplicates differ in size, so cdc mode has to wait for all.
+    # Names are still reserved in discovery order: a keeper whose name family
+    # has an earlier file waiting on dedup is held back until the end too.
+    stream = dedup_mode == "exact"
+    waiting_families: set[tuple[str, str, str]] = set()
+    held: list[tuple[int, str]] = []
+    for batch in _iter_files(str(resources_dir)):
+        for src_path, st in batch:
+            if os.path.basename(src_path) == ".gitkeep":
                 continue
-            entry.add(digest)
-        ext = src_path.suffix.lower()
-        if ext in IMAGE_EXTS:
-            _copy_file(src_path, images_dir)
-        elif ext in VIDEO_EXTS:
-            _copy_file(src_path, videos_dir)
+            # Hardlinks and bind mounts of an already seen file are the same
+            # bytes; skip them before reading anything. Windows reports
+            # st_ino as 0 from scandir, so only trust non-zero inodes.
+            if st.st_ino:
+                inode = (st.st_dev, st.st_ino)
+                if inode in seen_inodes:
+                    continue
+                seen_inodes.add(inode)
+            size = st.st_size
+            group = size_groups.get(size)
+            if group is None:
+                size_groups[size] = [(discovered, src_path)]
+                if stream:
+                    if copies.name_family(src_path) in waiting_families:
+                        held.append((discovered, src_path))
+                    else:
+                        copies.submit(src_path)
+            else:
+                group.append((discovered, src_path))
+                if stream:
+                    waiting_families.add(copies.name_family(src_path))
+            discovered += 1
+
+    # Across filesystems every copy is a full read, so collision candidates are
+    # copied into a staging dir while they are hashed and renamed into place.
+    staging_dir = None
+    if stream and not same_fs:
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=segregated_dir)
+    try:
+        unique, staged = _dedup_collisions(size_groups, staging_dir)
+        if stream:
+            keepers = {group[0] for group in size_groups.values()}
+            pending = set(held)
+            pending.update(item for item in unique if item not in keepers)
+            for item in sorted(pending):
+                copies.submit(item[1], staged.get(item))
         else:
-            _copy_file(src_path, others)
-        processed += 1
-        if processed % progress_every == 0 or processed == total:
-            percent = (processed / total) * 100 if total else 100
-            sys.stdout.write(f"\rProcessed {processed}/{total} files ({percent:5.1f}%)")
-            sys.stdout.flush()
-    if total:
-        sys.stdout.write("\n")
+            survivors = set(unique)
+            items = sorted(
+                (index, path, size)
+                for size, group in size_groups.items()
+                for index, path in group
+                if len(group) == 1 or (index, path) in survivors
+            )
+            for _, path, _ in _drop_near_duplicates(items, similarity):
+                copies.submit(path)
+        copies.close()
+    finally:
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _similarity(value: str) -> float:
+    number = float(value)
+    if not 0 < number <= 1:
+        raise argparse.ArgumentTypeError(f"must be in (0, 1], got {value}")
+    return number
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Deduplicate resources into segregated/images, videos and others."
+    )
+    parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help=(
+            "Hardlink instead of copying when resources and segregated share a "
+            "filesystem. Linked files share data, so editing one edits both."
+        ),
+    )
+    parser.add_argument(
+        "--dedup-mode",
+        choices=("exact", "cdc"),
+        default="exact",
+        help=(
+            "exact drops byte-identical files. cdc also drops large files "
+            "(over 2 MiB) that mostly share byte content with one already kept, "
+            "such as re-tagged videos, by comparing content-defined chunks. It "
+            "does not catch re-encoded or re-saved images, and smaller files "
+            "only get exact dedup. Needs the fastcdc package."
+        ),
+    )
+    parser.add_argument(
+        "--similarity",
+        type=_similarity,
+        default=CDC_SIMILARITY,
+        help=(
+            "Share of chunks, in (0, 1], two files must have in common to count "
+            "as duplicates in cdc mode."
+        ),
+    )
+    return parser.parse_args()
 
 
 def main() -> None:
+    args = parse_args()
     root = Path(__file__).resolve().parents[1]
     resources_dir = root / "resources"
     segregated_dir = root / "segregated"
     if not resources_dir.exists():
         raise SystemExit(f"resources folder not found: {resources_dir}")
-    segregate_resources(resources_dir, segregated_dir)
+    if args.dedup_mode == "cdc" and fastcdc is None:
+        raise SystemExit("--dedup-mode=cdc needs the fastcdc package: pip install fastcdc")
+    segregate_resources(
+        resources_dir, segregated_dir, args.hardlink, args.dedup_mode, args.similarity
+    )
 
 
 if __name__ == "__main__":